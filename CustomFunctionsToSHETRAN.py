@@ -9,10 +9,14 @@ This class contains the following functions (modules):
     - NetCDFPlotter             # Plots a variable in space and time
     - NetCDFToSHETRAN           # Wrangles NetCDF data into SHETRAN format
     - WFDE5NetCDFClipper        # Clips raw WFDE5 data in NetCDF format to extent of interest
+    - ASCtoArrayParam           # Reads in ASC data and writes as numpy array
     - ASCtoDfParam              # Reads in ASC data and writes as DataFrame
+    - ASCtoNpyParam             # Reads in ASC data via a memory-mapped NPY copy in a given directory
+    - ParamsToSuperCats         # Numbers soil categories and gathers their parameters
         
 """
 
+import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -160,31 +164,90 @@ def WFDE5NetCDFClipper(Path,
     print('WFDE5NetCDFClipper: Clipped WFDE5 written to:', Path + FileClipped)
 
 
+#%%
+# Reads ASC data and writes as numpy array
+def ASCtoArrayParam(Path,
+                    Nrows,
+                    Ncols,
+                    Dtype = np.float64,                                         # e.g. np.float32 to halve memory use
+                    ):
+    # Parse parameter values (Ncols) in each line (Nrows) as floats, skipping metadata rows
+    ParamArray = np.loadtxt(Path, dtype=Dtype, skiprows=6, ndmin=2)
+    
+    return(ParamArray.reshape(Nrows,Ncols))
+
+
 #%%
 # Reads ASC data and writes as DataFrame
 def ASCtoDfParam(Path,
                  Nrows,
-                 Ncols):
-    with open(Path) as File:                                                    # Read in each line from file
-        Lines = File.readlines()
-        Lines = [Line.rstrip() for Line in Lines]
-        
-    # Remove metadata rows
-    Lines = Lines [6:]
+                 Ncols,
+                 Dtype = np.float64,                                            # e.g. np.float32 to halve memory use
+                 ):
+    # Store values at x and y in DfParam
+    DfParam = pd.DataFrame(ASCtoArrayParam(Path, Nrows, Ncols, Dtype))
     
-    # Create blank DfParam to store values at x and y
-    DfParam = pd.DataFrame(np.zeros([Nrows,Ncols]))
+    return(DfParam)
+
+
+#%%
+# Reads ASC data via an NPY copy in DirectoryNpy, which is memory-mapped rather than loaded into RAM
+# NB the NPY copy is written on first read, and rewritten unless the ASC path, modification time and size
+# recorded alongside it in a .src file exactly match the ASC being read
+def ASCtoNpyParam(Path,
+                  Nrows,
+                  Ncols,
+                  DirectoryNpy,                                                 # NB string must terminate with '/', or be '' for the working directory
+                  Dtype = np.float64,                                           # e.g. np.float32 to halve memory use
+                  ):
+    NpyPath     = DirectoryNpy + os.path.splitext(os.path.basename(Path))[0] + '.npy'
+    SourcePath  = os.path.splitext(NpyPath)[0] + '.src'
     
-    # Split out each parameter string (Ncols) in each line string (Nrows)
-    for Line in range(len(Lines)):                                              # Loop over lines
-        ColList = (Lines[Line].split())                                         # ColList is a list of string parameters in a line
-        
-        for Col in range(len(ColList)):                                         # Loop over Cols
-            ParamStr                = ColList[Col]                              # ParamStr is a parameter string for a given col in a line
-            DfParam.iloc[Line,Col]  = ParamStr                                  # Write to DfParam
+    # Identify the ASC by its full path, exact modification time and size
+    Stat        = os.stat(Path)
+    Source      = repr((os.path.abspath(Path), Stat.st_mtime_ns, Stat.st_size))
+    
+    # Reuse the NPY copy if it was written from this exact ASC and matches the requested size and type
+    if os.path.exists(NpyPath) and os.path.exists(SourcePath):
+        with open(SourcePath) as File:
+            SourceMatch = File.read() == Source
         
-    # Convert parameter strings to floats
-    DfParam.iloc[:,:] = np.float64(DfParam.iloc[:,:])
+        if SourceMatch:
+            ParamArray = np.load(NpyPath, mmap_mode='r')
+            
+            if ParamArray.shape == (Nrows,Ncols) and ParamArray.dtype == Dtype:
+                return(ParamArray)
+            
+            del ParamArray                                                      # Close the map, as Windows cannot replace a mapped file
     
-    return(DfParam)
+    # Otherwise parse the ASC and write the NPY copy, recording its source only once the copy is complete
+    if os.path.exists(SourcePath):
+        os.remove(SourcePath)
+    
+    # Write to a temporary file first, then move it into place in one step
+    TmpPath     = os.path.splitext(NpyPath)[0] + '_tmp.npy'
+    np.save(TmpPath, ASCtoArrayParam(Path, Nrows, Ncols, Dtype))
+    os.replace(TmpPath, NpyPath)
+    
+    with open(SourcePath, 'w') as File:
+        File.write(Source)
+    
+    return(np.load(NpyPath, mmap_mode='r'))
+
+
+#%%
+# Numbers soil categories from unique values of the first parameter, and gathers all parameters for each category
+# NB ParamsFlat holds one 1D array of cells per parameter (e.g. memory-mapped grids), and categories are numbered in order of first appearance
+def ParamsToSuperCats(ParamsFlat):
+    # Replace each value of the first parameter with the index of its first appearance e.g. all -999s = 0
+    SuperCatCodes, Uniques = pd.factorize(ParamsFlat[0], sort=False)
+    SuperCatCodes = SuperCatCodes.astype(np.int32)                              # SuperCats never exceed the number of cells
+    
+    # New codes appear in ascending order, so each SuperCat first appears where the running maximum increases
+    FirstIdx = np.flatnonzero(np.diff(np.maximum.accumulate(SuperCatCodes), prepend=-1))
+    
+    # Gather all parameters at the first cell of each SuperCat, giving shape (number of parameters, number of SuperCats)
+    Supers = np.stack([Param[FirstIdx] for Param in ParamsFlat])
+    
+    return(SuperCatCodes, Supers)
 
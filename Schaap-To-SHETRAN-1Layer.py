@@ -12,6 +12,12 @@ This script:
                                  with parameters θSat, θRes, K, alpha, n)
     - generates Soil Details    (lines containing depth profiles of soil types 
                                  within each category)
+    - caches the grid size and soil categories in DirectoryOut, so that reruns
+      over unchanged ASC files skip reading and categorising them
+    - writes a binary .npy copy of each of the 5 ASC grids to DirectoryOut, with
+      a .src file recording which ASC it came from, so that the grids are only
+      parsed from text once. NB each copy takes Nrows * Ncols * 4 bytes for
+      float32 grids (8 for float64), and may be deleted at any time
     
 NB the 5 Maulem-van Genuchten soil parameters come from the 0.25° global grid 
 (Montzka et al., 2017). Each parameter was extracted from the NetCDF file using
@@ -29,7 +35,8 @@ The user must define:
     - 'FunctionsLibrary' which contains custom functions
     - 'DirectoryIn' which contains the ASC files
     - 'ResolutionKM' wich contains the resolution size in the ASC file name
-    - 'DirectoryOut' which contains the output TXT files
+    - 'DirectoryOut' which contains the output TXT files, and the cache, .npy
+      and .src files written by the script
     - 'SuperCatsOut' which names an output TXT file
     - 'SoilPropertiesOut' which names an output TXT file
     - 'SoilDetailsOut' which names an output TXT file
@@ -51,155 +58,153 @@ SoilDetailsOut      = ''
 #%% Import modules and functions
 
 import os
+import csv
 import numpy as np
 import pandas as pd
 import glob
-import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 os.chdir(FunctionsLibrary)                                                      # Sets working directory to enable custom functions to be used
-from CustomFunctionsToSHETRAN import ASCtoDfParam
+from CustomFunctionsToSHETRAN import ASCtoNpyParam, ParamsToSuperCats
+
+BufferSize = 1 << 20                                                            # Buffer output files in 1 MB blocks to reduce write calls
 
 
 #%% Read in each soil parameter ASC grid and specify its size
 
 PathList    = glob.glob(DirectoryIn + '*' + ResolutionKM + '*' + '.asc')        # Create list of files with full path names and extensions
 
-# Find size of ASC by searching through ASC metadata
-
-# Open the first ASC file
-File = open(PathList[0])
+# Create output directory if it does not exist (NB DirectoryOut = '' writes to the working directory)
+if DirectoryOut:
+    os.makedirs(DirectoryOut, exist_ok=True)
+
+# Type the parameter grids are read as
+# NB float32 holds the ASC values exactly and halves memory use compared with float64
+VG_Dtype     = np.float32
+
+# Check for grid size and SuperCats cached by a previous run over the same, unmodified ASC files
+# NB increase CacheVersion whenever reading, unit conversion or categorising changes, so that old caches are not reused
+CacheVersion = 1
+CachePath    = DirectoryOut + SuperCatsOut + '_Cache.npz'
+CacheKey     = hashlib.sha1(repr((CacheVersion,
+                                  np.dtype(VG_Dtype).str,
+                                  [(Path, os.stat(Path).st_mtime_ns, os.stat(Path).st_size) for Path in PathList[:5]],
+                                  )).encode()).hexdigest()
+CacheHit     = False
+
+if os.path.exists(CachePath):
+    with np.load(CachePath) as Cache:
+        if str(Cache['CacheKey']) == CacheKey:                                  # ASCs unchanged since the cache was written
+            CacheHit        = True
+            Nrows           = int(Cache['Nrows'])
+            Ncols           = int(Cache['Ncols'])
+            SuperCatCodes   = Cache['SuperCatCodes']
+            VG_Supers       = Cache['VG_Supers']
 
-# Read the content of the file opened
-Lines = File.readlines()
-
-# Find metadata lines containing array sizes and return integer
-NColsString = "ncols"
-NRowsString = "nrows"
-
-for LineNo in range(len(Lines)):
+# Find size of ASC by searching through ASC metadata
+if not CacheHit:
+    # Read only the 6 metadata lines at the top of the first ASC file
+    with open(PathList[0]) as File:
+        HeaderLines = [next(File) for LineNo in range(6)]
     
-    if Lines[LineNo].find(NColsString) != -1:
-        Ncols = [int(Num) for Num in re.findall('-?\d+\.?\d*', Lines[LineNo])][0]
-        
-    elif Lines[LineNo].find(NRowsString) != -1:
-        Nrows = [int(Num) for Num in re.findall('-?\d+\.?\d*', Lines[LineNo])][0]
-        
-    else:
-        ''
-
-
-#%% Create a subgrid of soil categories (i.e. each ASC grid cell)
-
-# Create blank DataFrame to match the ASC array size
-DfSubCats = pd.DataFrame(np.zeros([Nrows,Ncols]))
-
-# Populate DataFrame with sequential subgrid numbers (NB including NoData cells)
-for Row in range(len(DfSubCats)):                                               # Loop over rows
-    for Col in range(len(DfSubCats.columns)):                                   # Loop over cols
-        SubCats                 = int(1 + (Ncols * Row) + Col)                  # Create sequential SubCats numbers starting at 1
-        DfSubCats.iloc[Row,Col] = SubCats                                       # Save SubCats (integers) to df
-
-# Convert DataFrame to integer
-DfSubCats = DfSubCats.astype(int)
-
+    # Split each metadata line into a key and value, then return array sizes as integers
+    Header = {Key.lower(): Value for Key, Value in (Line.split()[:2] for Line in HeaderLines if Line.strip())}
+    
+    Ncols = int(Header['ncols'])
+    Nrows = int(Header['nrows'])
 
-#%% Read VanGenuchten parameters from ASCs
 
-# Call ASCtoDfParam function on each ASC
-DfVG_ThetaS = ASCtoDfParam(PathList[0], Nrows, Ncols)
-DfVG_ThetaR = ASCtoDfParam(PathList[1], Nrows, Ncols)
-DfVG_Ksat   = ASCtoDfParam(PathList[2], Nrows, Ncols)
-DfVG_Alpha  = ASCtoDfParam(PathList[3], Nrows, Ncols)
-DfVG_N      = ASCtoDfParam(PathList[4], Nrows, Ncols)
+#%% Read VanGenuchten parameters from ASCs (skipped if SuperCats were cached)
 
-# Flatten each 2D DataFrame to a 1D Series
-SubCats     = pd.Series(DfSubCats.values.flatten())
-VG_ThetaS   = pd.Series(DfVG_ThetaS.values.flatten())
-VG_ThetaR   = pd.Series(DfVG_ThetaR.values.flatten())
-VG_Ksat     = pd.Series(DfVG_Ksat.values.flatten())
-VG_Ksat     = VG_Ksat.apply(lambda x: x if x == -999 else x * 0.01 )            # Unit conversion from cm/d to m/d, ignoring NoData -999s
-VG_Alpha    = pd.Series(DfVG_Alpha.values.flatten())
-VG_N        = pd.Series(DfVG_N.values.flatten())
+if not CacheHit:
+    # Call ASCtoNpyParam function on each ASC concurrently, as the reads are independent
+    # NB each grid is memory-mapped from an NPY copy in DirectoryOut, which is only parsed from the ASC on first read
+    with ThreadPoolExecutor(max_workers=5) as Executor:
+        VG_List = list(Executor.map(lambda Path: ASCtoNpyParam(Path, Nrows, Ncols, DirectoryOut, VG_Dtype), PathList[:5]))
+    
+    # Flatten each 2D grid to a 1D view, giving one row per parameter while keeping the grids memory-mapped
+    VG_ParamsFlat = [VG_Param.reshape(-1) for VG_Param in VG_List]
 
 
 #%% Create a supergrid of soil categories matching the ASCs
 
-# Use the sets of unique parameters to identify the supergrids
-VG_ThetaS_unique            = pd.DataFrame(VG_ThetaS.unique(),columns=['ParamValue'])           # Extract unique values
-VG_ThetaS_unique['SubCats'] = VG_ThetaS_unique.index                                            # Add subcats (index by default)
-VG_ThetaS_unique_dict       = VG_ThetaS_unique.set_index('ParamValue')['SubCats'].to_dict()     # Create dict with unique ParamValue keys and SubCats values
-
-SuperCats = []                                                                                  # Create list to store supergrid SubCats numbers
-
-# Replace each ParamValue with corresponding SubCats in VG_ThetaS_unique_dict e.g. all -999s = 1
-for Item in range(len(VG_ThetaS)):
-    Value = VG_ThetaS[Item]
-    SuperCats.append(VG_ThetaS_unique_dict.get(Value))                          # Find corresponding SubCats
-
-SuperCats = pd.Series(SuperCats)
-
-# Create DfSuperCats
-DfSuperCats = pd.DataFrame().reindex_like(DfSubCats)
-DfSuperCats = pd.DataFrame(SuperCats.values.reshape(Nrows,Ncols))
-
-# Write DfSuperCats map to .txt file
-DfSuperCats.to_csv(path_or_buf = DirectoryOut + SuperCatsOut + '.txt',
-                   index    = False,
-                   header   = False,
-                   sep      = ' '
-                   )
+if not CacheHit:
+    # Use the set of unique VG_ThetaS values to identify the supergrids, and gather all 5 parameters for each
+    SuperCatCodes, VG_Supers = ParamsToSuperCats(VG_ParamsFlat)
+    
+    # Close the memory-mapped NPY copies, so that a rerun in the same console can rewrite them (NB required on Windows)
+    del VG_List, VG_ParamsFlat
+    
+    # Unit conversion of Ksat from cm/d to m/d in float64 on the gathered parameters, ignoring NoData -999s
+    VG_Supers    = VG_Supers.astype(np.float64)
+    VG_Supers[2] = np.where(VG_Supers[2] == -999, VG_Supers[2], VG_Supers[2] * 0.01)
+    
+    # Cache grid size and SuperCats to skip reading and categorising on reruns over the same ASCs
+    np.savez(CachePath,
+             CacheKey       = CacheKey,
+             Nrows          = Nrows,
+             Ncols          = Ncols,
+             SuperCatCodes  = SuperCatCodes,
+             VG_Supers      = VG_Supers
+             )
+
+# Create SuperCats map matching the ASC array size
+SuperCatsMap = SuperCatCodes.reshape(Nrows,Ncols)
+
+# Write SuperCats map to .txt file
+with open(DirectoryOut + SuperCatsOut + '.txt', 'w', newline='', buffering=BufferSize) as File:  # NB newline='' stops os.linesep being translated again
+    np.savetxt(File,
+               SuperCatsMap,
+               fmt          = '%d',
+               delimiter    = ' ',
+               newline      = os.linesep                                        # Match the line endings previously written by to_csv
+               )
 
 
 #%% Create supergrid of SoilProperties
 
-# Convert DataFrames to numpy arrays, flatten, then to pandas series
-SuperCats       = pd.Series(SuperCats.unique())
+SuperCats       = np.arange(VG_Supers.shape[1], dtype=np.int32)
 
-VG_SuperThetaS  = pd.Series(DfVG_ThetaS.values.flatten()).unique()
-VG_SuperThetaR  = pd.Series(DfVG_ThetaR.values.flatten()).unique()
-VG_SuperKsat    = pd.Series(DfVG_Ksat.values.flatten()).unique()
-VG_SuperAlpha   = pd.Series(DfVG_Alpha.values.flatten()).unique()
-VG_SuperN       = pd.Series(DfVG_N.values.flatten()).unique()
+VG_SuperThetaS, VG_SuperThetaR, VG_SuperKsat, VG_SuperAlpha, VG_SuperN = VG_Supers
 
 
 # Create DfSoilProperties with DfSoilSuperCats and VG parameters as columns
-DfSoilSuperProperties                    = pd.DataFrame()
-DfSoilSuperProperties['SoilProperty']    = pd.Series("<SoilProperty>", index=np.arange(len(SuperCats)))
-DfSoilSuperProperties['SuperCats']       = SuperCats
-DfSoilSuperProperties['SoilType']        = SuperCats
-DfSoilSuperProperties['VG_ThetaS']       = VG_SuperThetaS
-DfSoilSuperProperties['VG_ThetaR']       = VG_SuperThetaR
-DfSoilSuperProperties['VG_Ksat']         = VG_SuperKsat
-DfSoilSuperProperties['VG_alpha']        = VG_SuperAlpha
-DfSoilSuperProperties['VG_n']            = VG_SuperN
-DfSoilSuperProperties['</SoilProperty>'] = '</SoilProperty>'
+DfSoilSuperProperties = pd.DataFrame({'SoilProperty':     '<SoilProperty>',
+                                      'SuperCats':        SuperCats,
+                                      'SoilType':         SuperCats,
+                                      'VG_ThetaS':        VG_SuperThetaS,
+                                      'VG_ThetaR':        VG_SuperThetaR,
+                                      'VG_Ksat':          VG_SuperKsat,
+                                      'VG_alpha':         VG_SuperAlpha,
+                                      'VG_n':             VG_SuperN,
+                                      '</SoilProperty>':  '</SoilProperty>',
+                                      })
 
 # Write DfSoilSuperProperties to CSV file for SHETRAN library file
-DfSoilSuperProperties.to_csv(path_or_buf = DirectoryOut + SoilPropertiesOut + '.txt',
-                        index = False,
-                        header = True,
-                        sep = ','
-                        )
+with open(DirectoryOut + SoilPropertiesOut + '.txt', 'w', newline='', buffering=BufferSize) as File:
+    Writer = csv.writer(File, lineterminator=os.linesep)
+    Writer.writerow(DfSoilSuperProperties.columns)                              # Write header
+    Writer.writerows(DfSoilSuperProperties.itertuples(index=False))            # Write one line per SuperCat
 
 
 #%% Create SoilDetails corresponding to SoilProperties for SHETRAN library file
 
 # Create DfSuperDetails
-DfSuperDetails                   = pd.DataFrame()
-DfSuperDetails['<SoilDetails>']  = pd.Series("<SoilDetail>", index=np.arange(len(SuperCats)))
-DfSuperDetails['SuperCats']      = SuperCats
-DfSuperDetails['SoilLayer']      = 1
-DfSuperDetails['SoilType']       = SuperCats
-DfSuperDetails['Depth[m]']       = 2.0
-DfSuperDetails['</SoilDetails>'] = pd.Series("</SoilDetail>", index=np.arange(len(SuperCats)))
+DfSuperDetails = pd.DataFrame({'<SoilDetails>':   '<SoilDetail>',
+                               'SuperCats':       SuperCats,
+                               'SoilLayer':       1,
+                               'SoilType':        SuperCats,
+                               'Depth[m]':        2.0,
+                               '</SoilDetails>':  '</SoilDetail>',
+                               })
 
 
 # Write DfSuperDetails to CSV file for SHETRAN library file
-DfSuperDetails.to_csv(path_or_buf = DirectoryOut + SoilDetailsOut + '.txt',
-                      index = False,
-                      header = True,
-                      sep = ','
-                      )
+with open(DirectoryOut + SoilDetailsOut + '.txt', 'w', newline='', buffering=BufferSize) as File:
+    Writer = csv.writer(File, lineterminator=os.linesep)
+    Writer.writerow(DfSuperDetails.columns)                                     # Write header
+    Writer.writerows(DfSuperDetails.itertuples(index=False))                   # Write one line per SuperCat
 
 
 